@@ -2284,7 +2284,7 @@ def generate_doctor_images():
             }), 400
         
         # Initialize the generator
-        generator = DoctorImageGenerator(project_id)
+        generator = DoctorImageGenerator(project_id, storage_uri=os.environ.get('IMAGEN_STORAGE_URI'))
         
         # Start image generation in a background thread
         def generate_images():
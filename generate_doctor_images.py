@@ -4,43 +4,188 @@ Doctor Image Generator using Google Vertex AI Imagen
 Generates professional portrait images for all specialists in doctors.json
 """
 
+import asyncio
+import contextlib
 import json
+import logging
+import logging.handlers
 import os
-import base64
-import time
+import functools
+import hashlib
+import re
+import shutil
 import sys
+from concurrent.futures import Executor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional
-import requests
+from typing import AsyncContextManager, Callable, Dict, Iterator, List, Optional, Tuple
+from aiolimiter import AsyncLimiter
+from google.api_core import exceptions
 from google.auth import default
-from google.auth.transport.requests import Request
-import google.auth
+from google.cloud import aiplatform_v1, storage
+from google.protobuf import json_format
+from google.protobuf.struct_pb2 import Value
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
+try:
+    from pybase64 import b64decode
+except ImportError:  # SIMD decoder not installed
+    from base64 import b64decode
+
+try:
+    import ahocorasick
+except ImportError:  # Fall back to the precompiled regex
+    ahocorasick = None
+
+try:
+    import ijson.backends.yajl2_c as ijson
+except ImportError:  # C backend not built; use the pure-Python parser, or none at all
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+class ChunkedStreamHandler(logging.handlers.MemoryHandler):
+    """Buffer records and write each chunk to the stream with one write() and one flush().
+    
+    A MemoryHandler targeting a StreamHandler would still write and flush per record.
+    """
+
+    def __init__(self, stream, capacity: int):
+        super().__init__(capacity, flushLevel=logging.ERROR)
+        self.stream = stream
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                try:
+                    self.stream.write("".join(self.format(record) + "\n" for record in self.buffer))
+                    self.stream.flush()
+                except Exception:
+                    # Report and drop the chunk like StreamHandler would, rather than raising from logger calls
+                    self.handleError(self.buffer[-1])
+                finally:
+                    self.buffer.clear()
+        finally:
+            self.release()
+
+# Buffer progress output and write it in chunks of 64 records; errors flush immediately
+logger = logging.getLogger("doctor_gen")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+LOG_HANDLER = ChunkedStreamHandler(sys.stdout, capacity=64)
+LOG_HANDLER.setFormatter(logging.Formatter("%(message)s"))
+logger.addHandler(LOG_HANDLER)
+
+# Transient Imagen failures worth retrying, with exponential backoff
+RETRYABLE_ERRORS = (
+    exceptions.ResourceExhausted,
+    exceptions.InternalServerError,
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+)
+RETRY_INITIAL_DELAY = 0.5
+RETRY_MULTIPLIER = 2.0
+RETRY_MAX_DELAY = 4.0
+RETRY_DEADLINE = 300.0
+PREDICT_TIMEOUT = 120.0
+
+IMAGEN_MODEL = "imagegeneration@005"
+IMAGEN_PARAMETERS = {
+    "sampleCount": 1,
+    "aspectRatio": "1:1",  # Square format for profile images
+    "safetyFilterLevel": "block_some",
+    "personGeneration": "allow_adult",
+    "outputOptions": {"mimeType": "image/jpeg", "compressionQuality": 85},
+    # Filtered samples come back in position with a raiFilteredReason instead of being dropped
+    "includeRaiReason": True,
+}
+
+# Specialty-specific details for the portrait prompt
+SPECIALTY_DETAILS = {
+    'Gynecologist': 'medical doctor, warm and reassuring expression, white coat, stethoscope',
+    'Nutritionist': 'nutrition expert, friendly smile, professional attire, clean background',
+    'Ayurvedic Expert': 'traditional medicine practitioner, serene expression, traditional Indian attire or white coat',
+    'Therapist': 'mental health professional, compassionate expression, professional office setting',
+    'Fitness Coach': 'fitness trainer, energetic and motivating expression, athletic wear or professional fitness attire'
+}
+
+INDIAN_INDICATORS = ['Dr.', 'Priya', 'Sharma', 'Ananya', 'Reddy', 'Ravi', 'Patel', 'Neha', 'Gupta',
+                     'Sneha', 'Joshi', 'Meera', 'Krishnan', 'Leela', 'Menon', 'Kumar', 'Singh', 'Bhatia']
+
+# Substring match (no word boundaries), same as checking each indicator with `in`
+INDIAN_NAME_PATTERN = re.compile("|".join(map(re.escape, INDIAN_INDICATORS)))
+
+if ahocorasick:
+    # One Aho-Corasick walk over the name finds any indicator, however many there are
+    INDIAN_NAME_AUTOMATON = ahocorasick.Automaton()
+    for indicator in INDIAN_INDICATORS:
+        INDIAN_NAME_AUTOMATON.add_word(indicator, indicator)
+    INDIAN_NAME_AUTOMATON.make_automaton()
+
+    def is_likely_indian_name(name: str) -> bool:
+        return next(INDIAN_NAME_AUTOMATON.iter(name), None) is not None
+else:
+    def is_likely_indian_name(name: str) -> bool:
+        return INDIAN_NAME_PATTERN.search(name) is not None
+
+# ASCII filename cleanup: drop anything but letters, digits and '-', map spaces to '_'
+FILENAME_TRANSLATION = str.maketrans(
+    {chr(c): None for c in range(128) if not chr(c).isalnum() and chr(c) not in ' -'} | {' ': '_'}
+)
+
+@functools.lru_cache(maxsize=None)
+def _build_prompt(specialty: str, gender: str, is_likely_indian: bool) -> str:
+    """Build the Imagen prompt; doctors sharing these attributes share one prompt string."""
+    # Base professional prompt
+    base_prompt = f"Professional headshot portrait of a {gender} {specialty.lower()}"
+    
+    detail = SPECIALTY_DETAILS.get(specialty, 'healthcare professional, confident expression, professional attire')
+    ethnicity = "South Asian Indian" if is_likely_indian else "professional"
+    
+    return f"{base_prompt}, {ethnicity} appearance, {detail}, professional lighting, high quality portrait, medical setting background, confident and trustworthy demeanor, shot with professional camera, 8K resolution, realistic, photorealistic"
 
 class DoctorImageGenerator:
-    def __init__(self, project_id: str, location: str = "us-central1"):
-        """Initialize the image generator with Google Cloud credentials."""
+    def __init__(self, project_id: str, location: str = "us-central1", storage_uri: Optional[str] = None):
+        """Initialize the image generator with Google Cloud credentials.
+        
+        If storage_uri (a gs:// prefix) is given, Imagen writes images there and they
+        are downloaded as raw bytes instead of being returned base64-encoded.
+        """
         self.project_id = project_id
         self.location = location
-        self.endpoint = f"https://{location}-aiplatform.googleapis.com"
+        self.storage_uri = storage_uri
+        self.api_endpoint = f"{location}-aiplatform.googleapis.com"
+        self.model = f"projects/{project_id}/locations/{location}/publishers/google/models/{IMAGEN_MODEL}"
         
-        # Set up authentication
-        self.credentials, _ = default()
-        if hasattr(self.credentials, 'refresh'):
-            self.credentials.refresh(Request())
+        # Set up authentication; the gRPC auth plugin refreshes the token lazily on expiry
+        self.credentials, _ = default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
+        self.storage_client = storage.Client(project=project_id, credentials=self.credentials) if storage_uri else None
         
         # Paths
         self.base_path = Path(__file__).parent
         self.static_path = self.base_path / "static"
         self.images_path = self.static_path / "Images"
+        # Imagen output keyed by doctor, prompt, model and parameters, so re-runs don't repay.
+        # Kept outside static/ so it isn't served and survives filename scheme changes.
+        self.cache_dir = self.base_path / ".cache" / "imagen"
         self.doctors_json_path = self.static_path / "data" / "doctors.json"
+        self.progress_path = self.base_path / "doctors_progress.jsonl"
         
-        # Create images directory if it doesn't exist
+        # Create images and cache directories if they don't exist
         self.images_path.mkdir(parents=True, exist_ok=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
         
-        print(f"Initialized Doctor Image Generator")
-        print(f"Project ID: {project_id}")
-        print(f"Location: {location}")
-        print(f"Images will be saved to: {self.images_path}")
+        logger.info(f"Initialized Doctor Image Generator")
+        logger.info(f"Project ID: {project_id}")
+        logger.info(f"Location: {location}")
+        logger.info(f"Images will be saved to: {self.images_path}")
+        if storage_uri:
+            logger.info(f"Imagen output bucket: {storage_uri}")
 
     def generate_prompt_for_doctor(self, doctor: Dict) -> str:
         """Generate a detailed prompt for creating a professional doctor image."""
@@ -48,177 +193,440 @@ class DoctorImageGenerator:
         specialty = doctor.get('specialty', 'Healthcare Professional')
         gender = doctor.get('gender', 'person')
         
-        # Base professional prompt
-        base_prompt = f"Professional headshot portrait of a {gender} {specialty.lower()}"
-        
-        # Add specialty-specific details
-        specialty_details = {
-            'Gynecologist': 'medical doctor, warm and reassuring expression, white coat, stethoscope',
-            'Nutritionist': 'nutrition expert, friendly smile, professional attire, clean background',
-            'Ayurvedic Expert': 'traditional medicine practitioner, serene expression, traditional Indian attire or white coat',
-            'Therapist': 'mental health professional, compassionate expression, professional office setting',
-            'Fitness Coach': 'fitness trainer, energetic and motivating expression, athletic wear or professional fitness attire'
-        }
-        
-        detail = specialty_details.get(specialty, 'healthcare professional, confident expression, professional attire')
-        
         # Add cultural context for Indian names
-        indian_indicators = ['Dr.', 'Priya', 'Sharma', 'Ananya', 'Reddy', 'Ravi', 'Patel', 'Neha', 'Gupta', 
-                           'Sneha', 'Joshi', 'Meera', 'Krishnan', 'Leela', 'Menon', 'Kumar', 'Singh', 'Bhatia']
-        
-        is_likely_indian = any(indicator in name for indicator in indian_indicators)
-        ethnicity = "South Asian Indian" if is_likely_indian else "professional"
-        
-        full_prompt = f"{base_prompt}, {ethnicity} appearance, {detail}, professional lighting, high quality portrait, medical setting background, confident and trustworthy demeanor, shot with professional camera, 8K resolution, realistic, photorealistic"
-        
-        return full_prompt
+        return _build_prompt(specialty, gender, is_likely_indian_name(name))
 
-    def generate_image(self, prompt: str, filename: str) -> Optional[str]:
-        """Generate an image using Vertex AI Imagen API."""
+    async def generate_images_batch(self, client: aiplatform_v1.PredictionServiceAsyncClient,
+                                    prompt_filename_pairs: List[Tuple[str, str, Path]],
+                                    request_slot: Optional[Callable[[], AsyncContextManager]] = None,
+                                    writer: Optional[Executor] = None) -> List[Optional[str]]:
+        """Generate one image per (prompt, filename, cache_path) entry in a single Vertex AI Imagen request.
+        
+        request_slot returns a context held only for each predict call, so saving the images
+        (on the writer executor) overlaps the next request instead of occupying its slot.
+        If a multi-prompt request is rejected for its content (an invalid argument or a
+        short response), its prompts are retried one per request; quota and transient
+        errors fail the whole batch rather than multiply load on the endpoint.
+        """
+        failed = [None] * len(prompt_filename_pairs)
+        names = ", ".join(filename for _, filename, _ in prompt_filename_pairs)
         try:
-            # Imagen API endpoint
-            url = f"{self.endpoint}/v1/projects/{self.project_id}/locations/{self.location}/publishers/google/models/imagegeneration@005:predict"
+            # Request payload for Imagen, one instance per prompt
+            instances = [json_format.ParseDict({"prompt": prompt}, Value()) for prompt, _, _ in prompt_filename_pairs]
+            parameters = json_format.ParseDict({
+                **IMAGEN_PARAMETERS,
+                **({"storageUri": self.storage_uri} if self.storage_uri else {})
+            }, Value())
             
-            headers = {
-                "Authorization": f"Bearer {self.credentials.token}",
-                "Content-Type": "application/json"
-            }
+            for prompt, filename, _ in prompt_filename_pairs:
+                logger.info(f"Generating image: {filename}")
+                logger.info(f"Prompt: {prompt}")
             
-            # Request payload for Imagen
-            payload = {
-                "instances": [
-                    {
-                        "prompt": prompt
-                    }
-                ],
-                "parameters": {
-                    "sampleCount": 1,
-                    "aspectRatio": "1:1",  # Square format for profile images
-                    "safetyFilterLevel": "block_some",
-                    "personGeneration": "allow_adult"
-                }
-            }
+            try:
+                response = await self._predict(client, instances, parameters, request_slot, names)
+            except exceptions.GoogleAPICallError as e:
+                logger.error(f"❌ Error generating {names}: {e.code} - {e.message}")
+                # Only request-specific rejections can be pinned on one prompt
+                if len(prompt_filename_pairs) > 1 and isinstance(e, (exceptions.InvalidArgument, exceptions.FailedPrecondition)):
+                    return await self._generate_one_per_request(client, prompt_filename_pairs, request_slot, writer)
+                return failed
             
-            print(f"Generating image: {filename}")
-            print(f"Prompt: {prompt}")
+            predictions = [dict(prediction) for prediction in response.predictions]
             
-            response = requests.post(url, headers=headers, json=payload)
+            # Filtered samples keep their position, so a short response can't be matched up
+            if len(predictions) != len(prompt_filename_pairs):
+                logger.error(f"❌ Expected {len(prompt_filename_pairs)} images but got {len(predictions)} for {names}")
+                if len(prompt_filename_pairs) > 1:
+                    return await self._generate_one_per_request(client, prompt_filename_pairs, request_slot, writer)
+                return failed
             
-            if response.status_code == 200:
-                result = response.json()
+            return list(await asyncio.gather(*(
+                self._store_prediction(prediction, filename, cache_path, writer)
+                for prediction, (_, filename, cache_path) in zip(predictions, prompt_filename_pairs)
+            )))
                 
-                if 'predictions' in result and len(result['predictions']) > 0:
-                    # Get the base64 encoded image
-                    image_data = result['predictions'][0]['bytesBase64Encoded']
-                    
-                    # Decode and save the image
-                    image_bytes = base64.b64decode(image_data)
-                    image_path = self.images_path / filename
-                    
-                    with open(image_path, 'wb') as f:
-                        f.write(image_bytes)
-                    
-                    print(f"✅ Successfully generated: {filename}")
-                    return f"Images/{filename}"
-                else:
-                    print(f"❌ No image data in response for {filename}")
-                    return None
+        except Exception as e:
+            logger.error(f"❌ Exception generating {names}: {str(e)}")
+            return failed
+
+    async def _predict(self, client: aiplatform_v1.PredictionServiceAsyncClient, instances: List[Value],
+                       parameters: Value, request_slot: Optional[Callable[[], AsyncContextManager]],
+                       names: str) -> aiplatform_v1.PredictResponse:
+        """Call predict, retrying transient errors with backoff.
+        
+        Every attempt takes its own request slot, so retries are paced by the rate limiter
+        and the backoff sleep doesn't hold an in-flight slot.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + RETRY_DEADLINE
+        delay = RETRY_INITIAL_DELAY
+        while True:
+            try:
+                async with request_slot() if request_slot else contextlib.nullcontext():
+                    return await client.predict(
+                        endpoint=self.model,
+                        instances=instances,
+                        parameters=parameters,
+                        retry=None,
+                        timeout=PREDICT_TIMEOUT,
+                    )
+            except RETRYABLE_ERRORS as e:
+                if loop.time() + delay > deadline:
+                    raise
+                logger.info(f"🔁 Retrying {names} in {delay}s after {e.code} - {e.message}")
+            await asyncio.sleep(delay)
+            delay = min(delay * RETRY_MULTIPLIER, RETRY_MAX_DELAY)
+
+    async def _generate_one_per_request(self, client: aiplatform_v1.PredictionServiceAsyncClient,
+                                        prompt_filename_pairs: List[Tuple[str, str, Path]],
+                                        request_slot: Optional[Callable[[], AsyncContextManager]],
+                                        writer: Optional[Executor]) -> List[Optional[str]]:
+        """Retry a failed batch prompt by prompt so one bad prompt doesn't fail its batchmates."""
+        logger.info(f"🔁 Retrying {len(prompt_filename_pairs)} prompts one per request")
+        results = await asyncio.gather(*(
+            self.generate_images_batch(client, [entry], request_slot, writer) for entry in prompt_filename_pairs
+        ))
+        return [result[0] for result in results]
+
+    async def _store_prediction(self, prediction: Dict, filename: str, cache_path: Path,
+                                writer: Optional[Executor]) -> Optional[str]:
+        """Save one prediction's image off the event loop; return its image path, or None if it has none."""
+        if 'bytesBase64Encoded' not in prediction and 'gcsUri' not in prediction:
+            logger.error(f"❌ No image for {filename}: {prediction.get('raiFilteredReason', 'empty prediction')}")
+            return None
+        try:
+            loop = asyncio.get_running_loop()
+            image_path = self.images_path / filename
+            if 'gcsUri' in prediction:
+                # Downloads run on the shared pool so they don't queue behind the single writer
+                image_bytes = await loop.run_in_executor(None, self._download_image, prediction['gcsUri'])
+                await loop.run_in_executor(writer, self._save_image, image_bytes, cache_path, image_path)
             else:
-                print(f"❌ Error generating {filename}: {response.status_code} - {response.text}")
-                return None
-                
+                await loop.run_in_executor(writer, self._decode_and_save, prediction['bytesBase64Encoded'],
+                                           cache_path, image_path)
         except Exception as e:
-            print(f"❌ Exception generating {filename}: {str(e)}")
+            logger.error(f"❌ Exception saving {filename}: {str(e)}")
             return None
+        logger.info(f"✅ Successfully generated: {filename}")
+        return f"Images/{filename}"
+
+    def cache_path(self, doctor: Dict, prompt: str) -> Path:
+        """Return the cache location for a doctor's image under the current prompt, model and parameters."""
+        # Imagen output is random, so each doctor keeps their own portrait even when prompts match
+        identity = doctor.get('id', doctor.get('name'))
+        key_source = json.dumps([identity, prompt, IMAGEN_MODEL, IMAGEN_PARAMETERS], sort_keys=True)
+        key = hashlib.blake2b(key_source.encode('utf-8'), digest_size=16).hexdigest()
+        return self.cache_dir / f"{key}.jpg"
+
+    def _download_image(self, gcs_uri: str) -> bytes:
+        """Fetch an image Imagen wrote to GCS."""
+        return storage.Blob.from_string(gcs_uri, client=self.storage_client).download_as_bytes()
+
+    def _decode_and_save(self, image_data: str, cache_path: Path, image_path: Path):
+        """Decode an inline base64 image and save it."""
+        self._save_image(b64decode(image_data), cache_path, image_path)
+
+    def _save_image(self, image_bytes: bytes, cache_path: Path, image_path: Path):
+        """Write image bytes to the cache and link them into place."""
+        self._write_image(cache_path, image_bytes)
+        self._link_image(cache_path, image_path)
+
+    @staticmethod
+    def _link_image(cache_path: Path, image_path: Path):
+        """Hardlink a cached image to its doctor filename, copying where links aren't supported."""
+        tmp_path = f"{image_path}.tmp"
+        if os.path.lexists(tmp_path):
+            os.unlink(tmp_path)
+        try:
+            os.link(cache_path, tmp_path)
+        except OSError:
+            shutil.copyfile(cache_path, tmp_path)
+        os.replace(tmp_path, image_path)
+
+    @staticmethod
+    def _write_image(image_path: Path, image_bytes: bytes):
+        """Write image bytes to disk atomically."""
+        image_bytes = memoryview(image_bytes)
+        tmp_path = f"{image_path}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            while image_bytes:
+                image_bytes = image_bytes[os.write(fd, image_bytes):]
+        finally:
+            os.close(fd)
+        # Readers only ever see a missing file or a complete one
+        os.replace(tmp_path, image_path)
 
     def load_doctors_data(self) -> List[Dict]:
         """Load doctors data from JSON file."""
         try:
-            with open(self.doctors_json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data.get('doctors', [])
+            with open(self.doctors_json_path, 'rb') as f:
+                raw = f.read()
+            data = orjson.loads(raw) if orjson else json.loads(raw)
+            return data.get('doctors', [])
         except Exception as e:
-            print(f"❌ Error loading doctors data: {str(e)}")
+            logger.error(f"❌ Error loading doctors data: {str(e)}")
             return []
 
-    def save_doctors_data(self, doctors: List[Dict]):
+    def iter_doctors(self) -> Iterator[Dict]:
+        """Stream doctors from the JSON file without materializing the whole array first."""
+        if ijson is None:
+            yield from self.load_doctors_data()
+            return
+        with open(self.doctors_json_path, 'rb') as f:
+            # use_float keeps ratings as float rather than Decimal so they serialize back out
+            yield from ijson.items(f, 'doctors.item', use_float=True)
+
+    def save_doctors_data(self, doctors: List[Dict]) -> bool:
         """Save updated doctors data back to JSON file."""
         try:
             data = {'doctors': doctors}
-            with open(self.doctors_json_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4, ensure_ascii=False)
-            print("✅ Updated doctors.json with new image paths")
+            if orjson:
+                payload = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+            else:
+                payload = json.dumps(data, indent=2, ensure_ascii=False).encode('utf-8')
+            with open(self.doctors_json_path, 'wb') as f:
+                f.write(payload)
+            logger.info("✅ Updated doctors.json with new image paths")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Error saving doctors data: {str(e)}")
+            return False
+
+    def load_progress(self) -> Dict[str, str]:
+        """Load name -> image mappings recorded by an interrupted run."""
+        progress = {}
+        if not self.progress_path.exists():
+            return progress
+        try:
+            with open(self.progress_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append can leave a truncated last line
+                        continue
+                    progress[entry['name']] = entry['image']
         except Exception as e:
-            print(f"❌ Error saving doctors data: {str(e)}")
+            logger.error(f"❌ Error loading progress log: {str(e)}")
+        return progress
+
+    def validate_doctor(self, doctor: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """Return (filename, None) for a usable doctor entry, or (None, reason) if it can't get an image."""
+        if not isinstance(doctor, dict):
+            return None, "entry is not an object"
+        name = doctor.get('name')
+        if not isinstance(name, str) or not name.strip():
+            return None, "missing name"
+        clean_name = self.clean_name(name)
+        if not clean_name:
+            return None, f"name {name!r} has no usable filename characters"
+        return f"ai_generated_{clean_name}.jpg", None
+
+    @staticmethod
+    def clean_name(name: str) -> str:
+        """Reduce a doctor's name to lowercase letters, digits, '-' and '_' for use in a filename."""
+        name = name.lower()
+        if name.isascii():
+            # Remove special characters and turn spaces into underscores in one C-level pass
+            return name.translate(FILENAME_TRANSLATION).strip('_')
+        # Keep non-ASCII letters and digits the same way str.isalnum() does
+        clean_name = ''.join(c for c in name if c.isalnum() or c in (' ', '-')).strip()
+        return clean_name.replace(' ', '_')
 
     def generate_filename(self, doctor: Dict) -> str:
         """Generate a filename for the doctor's image."""
-        name = doctor.get('name', 'doctor').lower()
-        # Remove special characters and spaces
-        clean_name = ''.join(c for c in name if c.isalnum() or c in (' ', '-')).strip()
-        clean_name = clean_name.replace(' ', '_')
-        return f"ai_generated_{clean_name}.jpg"
+        return f"ai_generated_{self.clean_name(doctor.get('name', 'doctor'))}.jpg"
 
-    def generate_all_images(self, batch_size: int = 5, delay: float = 2.0):
-        """Generate images for all doctors in the JSON file."""
-        doctors = self.load_doctors_data()
+    def generate_all_images(self, batch_size: int = 5, delay: float = 2.0, images_per_request: int = 1,
+                            requests_per_minute: Optional[int] = None):
+        """Generate images for all doctors in the JSON file.
         
-        if not doctors:
-            print("❌ No doctors data found!")
-            return
+        Requests are paced at batch_size per delay seconds, or at requests_per_minute
+        (e.g. the project's Imagen quota) when given. images_per_request > 1 sends several
+        prompts per predict call.
+        """
+        try:
+            asyncio.run(self._generate_all_images(batch_size, delay, images_per_request, requests_per_minute))
+        finally:
+            LOG_HANDLER.flush()
+
+    async def _generate_all_images(self, batch_size: int, delay: float, images_per_request: int,
+                                   requests_per_minute: Optional[int]):
+        """Generate missing images concurrently, at most batch_size requests in flight."""
+        logger.info(f"🚀 Starting image generation...")
+        
+        # One directory scan up front instead of a stat() per doctor
+        existing = set(os.listdir(self.images_path))
         
-        print(f"🚀 Starting image generation for {len(doctors)} doctors...")
+        # Mappings recorded by an interrupted run
+        progress = self.load_progress()
         
-        updated_doctors = []
+        semaphore = asyncio.Semaphore(batch_size)
+        # Rate limiting: a token bucket, so in-flight requests don't hold up the next start
+        if requests_per_minute:
+            rate_limiter = AsyncLimiter(max_rate=requests_per_minute, time_period=60)
+        elif delay > 0:
+            rate_limiter = AsyncLimiter(max_rate=batch_size, time_period=delay)
+        else:
+            rate_limiter = contextlib.nullcontext()
         generated_count = 0
+        reused_count = 0
+        invalid_count = 0
+        checkpoint_count = 0
+        # Filename -> later doctors mapping to it, so a queued image isn't generated twice this run
+        queued: Dict[str, List[Dict]] = {}
+        
+        def record_image(doctor: Dict, image_path: str):
+            """Point a doctor at its new image and checkpoint the mapping."""
+            nonlocal checkpoint_count
+            doctor['image'] = image_path
+            checkpoint_count += 1
+            
+            # Append-only checkpoint so a crash doesn't lose this mapping
+            progress_log.write(json.dumps({"name": doctor.get('name'), "image": image_path}) + "\n")
+            progress_log.flush()
+            if checkpoint_count % batch_size == 0:
+                os.fsync(progress_log.fileno())
         
-        for i, doctor in enumerate(doctors):
+        def prepare_doctor(i: int, doctor: Dict) -> Optional[Tuple[Dict, str, str, Path]]:
+            """Resolve a doctor to (doctor, prompt, filename, cache_path), or None if nothing to generate."""
+            nonlocal invalid_count
+            
+            # Reject unusable entries before any prompt or API work; the filename comes from the same pass
+            filename, reason = self.validate_doctor(doctor)
+            if reason:
+                invalid_count += 1
+                logger.warning(f"⚠️  Skipping doctor entry {i+1}: {reason}")
+                return None
+            
             try:
-                print(f"\n--- Processing {i+1}/{len(doctors)}: {doctor.get('name')} ---")
+                logger.info(f"\n--- Processing {i+1}: {doctor.get('name')} ---")
                 
-                # Generate filename
-                filename = self.generate_filename(doctor)
+                # Reuse a previous run's mapping if its image is still on disk
+                recorded = progress.get(doctor.get('name'))
+                if recorded and Path(recorded).name in existing:
+                    logger.info(f"⏭️  Already generated in a previous run: {recorded}")
+                    doctor['image'] = recorded
+                    return None
                 
                 # Check if image already exists
-                existing_path = self.images_path / filename
-                if existing_path.exists():
-                    print(f"⏭️  Image already exists: {filename}")
+                if filename in existing:
+                    logger.info(f"⏭️  Image already exists: {filename}")
                     doctor['image'] = f"Images/{filename}"
-                    updated_doctors.append(doctor)
-                    continue
+                    return None
+                
+                if filename in queued:
+                    logger.info(f"⏭️  Image already queued this run: {filename}")
+                    queued[filename].append(doctor)
+                    return None
                 
                 # Generate prompt
                 prompt = self.generate_prompt_for_doctor(doctor)
                 
-                # Generate image
-                image_path = self.generate_image(prompt, filename)
+                # Generated for this doctor before: link instead of paying for another call
+                cache_path = self.cache_path(doctor, prompt)
+                if cache_path.exists():
+                    reuse_cached(doctor, cache_path, filename)
+                    existing.add(filename)
+                    return None
                 
-                if image_path:
-                    # Update doctor data with new image path
-                    doctor['image'] = image_path
-                    generated_count += 1
-                    print(f"✅ Generated image {generated_count}: {filename}")
-                else:
-                    print(f"⚠️  Failed to generate image for {doctor.get('name')}, keeping original")
+                queued[filename] = []
+                return doctor, prompt, filename, cache_path
                 
-                updated_doctors.append(doctor)
+            except Exception as e:
+                logger.error(f"❌ Error processing {doctor.get('name')}: {str(e)}")
+                return None
+        
+        def reuse_cached(doctor: Dict, cache_path: Path, filename: str):
+            nonlocal reused_count
+            self._link_image(cache_path, self.images_path / filename)
+            record_image(doctor, f"Images/{filename}")
+            reused_count += 1
+            logger.info(f"♻️  Reused cached image: {filename}")
+        
+        @contextlib.asynccontextmanager
+        async def request_slot():
+            async with semaphore, rate_limiter:
+                yield
+        
+        async def process_batch(client: aiplatform_v1.PredictionServiceAsyncClient, batch: List[Tuple[Dict, str, str, Path]]):
+            nonlocal generated_count
+            try:
+                # Generate images
+                image_paths = await self.generate_images_batch(
+                    client, [(prompt, filename, cache_path) for _, prompt, filename, cache_path in batch],
+                    request_slot=request_slot, writer=writer)
                 
-                # Rate limiting
-                if (i + 1) % batch_size == 0 and i + 1 < len(doctors):
-                    print(f"⏸️  Rate limiting: sleeping for {delay} seconds...")
-                    time.sleep(delay)
-                    
+                for (doctor, _, filename, _), image_path in zip(batch, image_paths):
+                    sharers = queued.pop(filename, [])
+                    if image_path:
+                        # Update doctor data with new image path
+                        existing.add(filename)
+                        record_image(doctor, image_path)
+                        generated_count += 1
+                        logger.info(f"✅ Generated image {generated_count}: {filename}")
+                        for sharer in sharers:
+                            record_image(sharer, image_path)
+                    else:
+                        for failed_doctor in [doctor] + sharers:
+                            logger.warning(f"⚠️  Failed to generate image for {failed_doctor.get('name')}, keeping original")
+                        
+            except Exception as e:
+                logger.error(f"❌ Error processing {', '.join(str(doctor.get('name')) for doctor, _, _, _ in batch)}: {str(e)}")
+        
+        # One gRPC channel per run; HTTP/2 multiplexes every in-flight predict over it
+        client = aiplatform_v1.PredictionServiceAsyncClient(
+            credentials=self.credentials,
+            client_options={"api_endpoint": self.api_endpoint},
+        )
+        # A single writer thread drains decode/download + disk writes while requests keep flowing
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-writer")
+        progress_log = open(self.progress_path, 'a', encoding='utf-8')
+        doctors = []
+        tasks = []
+        try:
+            # Dispatch each full batch as soon as it is parsed so requests overlap the rest of the parse
+            pending = []
+            try:
+                for i, doctor in enumerate(self.iter_doctors()):
+                    doctors.append(doctor)
+                    work = prepare_doctor(i, doctor)
+                    if work:
+                        pending.append(work)
+                    if len(pending) >= images_per_request:
+                        tasks.append(asyncio.create_task(process_batch(client, pending)))
+                        pending = []
+                        await asyncio.sleep(0)
+                if pending:
+                    tasks.append(asyncio.create_task(process_batch(client, pending)))
             except Exception as e:
-                print(f"❌ Error processing {doctor.get('name')}: {str(e)}")
-                updated_doctors.append(doctor)
-                continue
+                logger.error(f"❌ Error loading doctors data: {str(e)}")
+                # Never write a partially parsed catalog back over doctors.json
+                doctors = []
+            await asyncio.gather(*tasks)
+        finally:
+            await client.transport.close()
+            writer.shutdown(wait=True)
+            progress_log.flush()
+            os.fsync(progress_log.fileno())
+            progress_log.close()
+        
+        if not doctors:
+            logger.error("❌ No doctors data found!")
+            return
         
-        # Save updated data
-        self.save_doctors_data(updated_doctors)
+        # Save updated data; the progress log is only needed until doctors.json holds it
+        if self.save_doctors_data(doctors):
+            self.progress_path.unlink(missing_ok=True)
         
-        print(f"\n🎉 Image generation complete!")
-        print(f"📊 Generated {generated_count} new images out of {len(doctors)} doctors")
-        print(f"📁 Images saved to: {self.images_path}")
+        logger.info(f"\n🎉 Image generation complete!")
+        logger.info(f"📊 Generated {generated_count} new images out of {len(doctors)} doctors")
+        if reused_count:
+            logger.info(f"♻️  Reused {reused_count} cached images")
+        if invalid_count:
+            logger.warning(f"⚠️  Skipped {invalid_count} invalid doctor entries")
+        logger.info(f"📁 Images saved to: {self.images_path}")
 
 def main():
     """Main function to run the image generator."""
@@ -231,13 +639,13 @@ def main():
         project_id = sys.argv[1]
     
     if not project_id:
-        print("❌ Error: Google Cloud Project ID is required!")
-        print("Set the GOOGLE_CLOUD_PROJECT environment variable or pass it as an argument:")
-        print("python generate_doctor_images.py YOUR_PROJECT_ID")
+        logger.error("❌ Error: Google Cloud Project ID is required!")
+        logger.info("Set the GOOGLE_CLOUD_PROJECT environment variable or pass it as an argument:")
+        logger.info("python generate_doctor_images.py YOUR_PROJECT_ID")
         sys.exit(1)
     
-    # Initialize generator
-    generator = DoctorImageGenerator(project_id)
+    # Initialize generator; optionally have Imagen write to a GCS prefix
+    generator = DoctorImageGenerator(project_id, storage_uri=os.environ.get('IMAGEN_STORAGE_URI'))
     
     # Generate all images
     generator.generate_all_images()